@@ -0,0 +1,224 @@
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Execution backends for the post-crawl analytics. "pandas" is the original path,
+# "arrow" keeps the data in pyarrow buffers, "polars" (optional dependency) runs
+# on a polars DataFrame built zero-copy from the Arrow table.
+# Crawl, replay and enrichment still produce a pandas DataFrame: process_listings
+# converts it to Arrow once, so the arrow/polars backends pay one full copy (and
+# briefly both frames in memory) before staying columnar up to the aggregations.
+BACKENDS = ("pandas", "arrow", "polars")
+DEFAULT_BACKEND = "pandas"
+INDEX_COLUMN = "realEstate_id"
+
+
+def get_backend():
+    # Backend is selected with the ANALYTICS_BACKEND environment variable
+    backend = os.environ.get("ANALYTICS_BACKEND", DEFAULT_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown analytics backend '{backend}', expected one of {BACKENDS}")
+    return backend
+
+
+def _import_polars():
+    try:
+        import polars as pl
+    except ImportError:
+        raise ImportError("The 'polars' analytics backend requires the polars package (pip install polars)")
+    return pl
+
+
+def _arrow_column(series):
+    # Columns Arrow cannot type (mixed nested payloads) are stored as their string repr
+    try:
+        return pa.Array.from_pandas(series)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.Array.from_pandas(series.astype(str).where(series.notna(), None))
+
+
+def _to_arrow(df):
+    # Copies every column out of pandas, see the note at the top of the module
+    names = [df.index.name or INDEX_COLUMN] + [str(col) for col in df.columns]
+    arrays = [_arrow_column(df.index.to_series())] + [_arrow_column(df[col]) for col in df.columns]
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def _to_polars(table):
+    pl = _import_polars()
+    # Dictionary columns become Enums so the pandas category order survives
+    enums = {}
+    for field in table.schema:
+        if not pa.types.is_dictionary(field.type):
+            continue
+        if pa.types.is_string(field.type.value_type) or pa.types.is_large_string(field.type.value_type):
+            enums[field.name] = _arrow_categories(table.column(field.name))
+        else:
+            index = table.schema.get_field_index(field.name)
+            table = table.set_column(index, field.name, _decoded(table.column(field.name)))
+    frame = pl.from_arrow(table)
+    if enums:
+        frame = frame.with_columns([pl.col(name).cast(pl.String).cast(pl.Enum(categories))
+                                    for name, categories in enums.items()])
+    return frame
+
+
+def _arrow_categories(column):
+    # Category order of a dictionary-encoded Arrow column, None for plain columns
+    if not pa.types.is_dictionary(column.type):
+        return None
+    column = pa.table({'column': column}).unify_dictionaries().column('column')
+    return column.chunk(0).dictionary.to_pylist() if column.num_chunks else []
+
+
+def _decoded(column):
+    if pa.types.is_dictionary(column.type):
+        return column.cast(column.type.value_type)
+    return column
+
+
+def process_listings(df, backend=DEFAULT_BACKEND):
+    # Clean the surface string and compute the price per square meter
+    if backend == "pandas":
+        df['surface'] = df['surface'].str.replace(' m²', '').astype(float)
+        df['priceperm2'] = df['price_value'] / df['surface']
+        return df
+
+    table = _to_arrow(df)
+    surface = pc.cast(pc.replace_substring(_decoded(table.column('surface')), ' m²', ''), pa.float64())
+    priceperm2 = pc.divide(pc.cast(table.column('price_value'), pa.float64()), surface)
+    # pandas treats NaN (e.g. 0/0) as missing in every aggregation, Arrow needs nulls
+    priceperm2 = pc.if_else(pc.is_nan(priceperm2), pa.scalar(None, pa.float64()), priceperm2)
+    table = table.set_column(table.schema.get_field_index('surface'), 'surface', surface)
+    table = table.append_column('priceperm2', priceperm2)
+
+    if backend == "polars":
+        return _to_polars(table)
+    return table
+
+
+def filter_sales(data, backend=DEFAULT_BACKEND):
+    # Exclude auctions: keep only the listings with a plain sale contract
+    if backend == "pandas":
+        return data[data['realEstate_contract'] == 'sale']
+    if backend == "polars":
+        pl = _import_polars()
+        return data.filter(pl.col('realEstate_contract') == 'sale')
+    return data.filter(pc.equal(_decoded(data.column('realEstate_contract')), 'sale'))
+
+
+def summary_stats(data, backend=DEFAULT_BACKEND):
+    if backend == "pandas":
+        return {
+            'count': len(data),
+            'price_mean': data['price_value'].mean(),
+            'surface_mean': data['surface'].mean(),
+            'priceperm2_median': data['priceperm2'].median(),
+            'price_min': data['price_value'].min(),
+            'price_max': data['price_value'].max(),
+        }
+
+    if backend == "polars":
+        pl = _import_polars()
+        row = data.select(
+            pl.col('price_value').mean().alias('price_mean'),
+            pl.col('surface').mean().alias('surface_mean'),
+            pl.col('priceperm2').median().alias('priceperm2_median'),
+            pl.col('price_value').min().alias('price_min'),
+            pl.col('price_value').max().alias('price_max'),
+        ).row(0, named=True)
+        stats = {'count': len(data)}
+        stats.update({key: float('nan') if value is None else value for key, value in row.items()})
+        return stats
+
+    def scalar(value):
+        value = value.as_py()
+        return float('nan') if value is None else value
+
+    price = data.column('price_value')
+    return {
+        'count': len(data),
+        'price_mean': scalar(pc.mean(price)),
+        'surface_mean': scalar(pc.mean(data.column('surface'))),
+        'priceperm2_median': scalar(pc.quantile(data.column('priceperm2'), q=0.5)[0]),
+        'price_min': scalar(pc.min(price)),
+        'price_max': scalar(pc.max(price)),
+    }
+
+
+def _align_to_pandas(result, feature, categories):
+    # Match the pandas groupby output: category order (with unobserved categories)
+    # for categoricals, sorted keys otherwise
+    if categories is None:
+        return result.sort_values(feature).reset_index(drop=True)
+    result = result.set_index(feature).reindex(categories)
+    result.index = pd.CategoricalIndex(result.index, categories=categories, name=feature)
+    return result.reset_index()
+
+
+def mean_by_feature(data, feature, backend=DEFAULT_BACKEND, value='priceperm2'):
+    # Average of value for each feature level, same shape as groupby().mean().reset_index()
+    if backend == "pandas":
+        return data.groupby(feature, observed=False)[value].mean().reset_index()
+
+    if backend == "polars":
+        pl = _import_polars()
+        dtype = data.schema[feature]
+        categories = dtype.categories.to_list() if isinstance(dtype, pl.Enum) else None
+        key = pl.col(feature).cast(pl.String) if categories is not None else pl.col(feature)
+        result = (data.lazy()
+                  .select(key, pl.col(value))
+                  .filter(pl.col(feature).is_not_null())
+                  .group_by(feature)
+                  .agg(pl.col(value).mean())
+                  .collect()
+                  .to_pandas())
+        return _align_to_pandas(result, feature, categories)
+
+    column = data.column(feature)
+    categories = _arrow_categories(column)
+    table = pa.table({feature: _decoded(column), value: data.column(value)})
+    table = table.filter(pc.is_valid(table.column(feature)))
+    grouped = table.group_by(feature).aggregate([(value, 'mean')])
+    result = pa.table({feature: grouped.column(feature), value: grouped.column(f'{value}_mean')})
+    return _align_to_pandas(result.to_pandas(), feature, categories)
+
+
+def count_by_feature(data, feature, backend=DEFAULT_BACKEND):
+    # Number of listings per feature level, same as Series.value_counts()
+    if backend == "pandas":
+        return data[feature].value_counts()
+
+    if backend == "polars":
+        pl = _import_polars()
+        dtype = data.schema[feature]
+        categories = dtype.categories.to_list() if isinstance(dtype, pl.Enum) else None
+        counts = (data.select(pl.col(feature).cast(pl.String) if categories is not None else pl.col(feature))
+                  .drop_nulls()
+                  .group_by(feature, maintain_order=True)
+                  .len())
+        counts = dict(zip(counts[feature].to_list(), counts['len'].to_list()))
+    else:
+        column = data.column(feature)
+        categories = _arrow_categories(column)
+        counted = pc.value_counts(_decoded(column).drop_null())
+        counts = dict(zip(counted.field('values').to_pylist(), counted.field('counts').to_pylist()))
+
+    index = pd.Index(list(counts), name=feature)
+    if categories is not None:
+        counts = {category: counts.get(category, 0) for category in categories}
+        index = pd.CategoricalIndex(list(counts), categories=categories, name=feature)
+    result = pd.Series(list(counts.values()), index=index, dtype='int64', name='count')
+    return result.sort_values(ascending=False, kind='stable')
+
+
+def to_pandas(data, backend=DEFAULT_BACKEND, columns=None):
+    # Materialize (a projection of) the data as pandas, indexed by listing id
+    if backend == "pandas":
+        return data
+    if backend == "polars":
+        data = data.to_arrow()
+    if columns is not None:
+        data = data.select([INDEX_COLUMN] + [col for col in columns if col != INDEX_COLUMN])
+    return data.to_pandas().set_index(INDEX_COLUMN)
@@ -0,0 +1,114 @@
+import os
+import json
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+
+# Raw API responses are appended to an archive so pages can be re-parsed offline.
+# Every page is stored as an independent zstd frame in pages.zst, and index.jsonl
+# records url, timestamp, crawl id, offset and length of each frame. Both files
+# are only ever appended to. The crawl id (the crawl start time) groups the pages
+# of one search run, so replay can rebuild a single crawl. Set RAW_ARCHIVE_DIR to
+# an empty string to disable archiving.
+ARCHIVE_DIR = os.environ.get("RAW_ARCHIVE_DIR", "./archive")
+DATA_FILE = "pages.zst"
+INDEX_FILE = "index.jsonl"
+COMPRESSION_LEVEL = 3
+
+# Pages are fetched from a thread pool, appends must not interleave
+_lock = threading.Lock()
+
+
+def _import_zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("The raw response archive requires the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+def archive_page(url, text, directory=ARCHIVE_DIR, timestamp=None, crawl_id=None):
+    if not directory:
+        return None
+    zstd = _import_zstd()
+    frame = zstd.ZstdCompressor(level=COMPRESSION_LEVEL).compress(text.encode('utf-8'))
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc).isoformat()
+
+    with _lock:
+        os.makedirs(directory, exist_ok=True)
+        # Data is written before the index line, so an interrupted append leaves
+        # at most an unreferenced frame behind
+        with open(os.path.join(directory, DATA_FILE), 'ab') as data_file:
+            offset = data_file.seek(0, os.SEEK_END)
+            data_file.write(frame)
+        record = {'url': url, 'timestamp': timestamp, 'crawl_id': crawl_id, 'offset': offset, 'length': len(frame)}
+        with open(os.path.join(directory, INDEX_FILE), 'a', encoding='utf-8') as index_file:
+            index_file.write(json.dumps(record) + '\n')
+    return record
+
+
+def crawl_of(record):
+    # Pages archived before crawl ids existed are grouped by day
+    return record.get('crawl_id') or record['timestamp'][:10]
+
+
+def read_index(directory=ARCHIVE_DIR, match=None, since=None, until=None, crawl_id=None):
+    """
+    Read the archive index, optionally filtered.
+
+    Args:
+        directory (str): Archive directory
+        match (dict): Query parameters the archived URL must have (e.g. {'idComune': 1234})
+        since (str): Keep records with an ISO timestamp >= since
+        until (str): Keep records with an ISO timestamp < until
+        crawl_id (str): Keep only the pages of this crawl
+
+    Returns:
+        list: Index records (url, timestamp, crawl_id, offset, length) in append order
+    """
+    index_path = os.path.join(directory, INDEX_FILE)
+    if not directory or not os.path.exists(index_path):
+        return []
+
+    records = []
+    with open(index_path, 'r', encoding='utf-8') as index_file:
+        for line in index_file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Partially written last line
+                continue
+            if since and record['timestamp'] < since:
+                continue
+            if until and record['timestamp'] >= until:
+                continue
+            if crawl_id and crawl_of(record) != crawl_id:
+                continue
+            if match:
+                params = parse_qs(urlsplit(record['url']).query)
+                if any(params.get(key, [None])[0] != str(value) for key, value in match.items()):
+                    continue
+            records.append(record)
+    return records
+
+
+def list_crawls(directory=ARCHIVE_DIR, match=None):
+    # Archived crawls matching the search, newest first, with their page count
+    crawls = {}
+    for record in read_index(directory, match):
+        crawls[crawl_of(record)] = crawls.get(crawl_of(record), 0) + 1
+    return dict(sorted(crawls.items(), reverse=True))
+
+
+def iter_archive(directory=ARCHIVE_DIR, match=None, since=None, until=None, crawl_id=None):
+    # Yield (url, timestamp, text) for every archived page selected by read_index
+    records = read_index(directory, match, since, until, crawl_id)
+    if not records:
+        return
+    decompressor = _import_zstd().ZstdDecompressor()
+    with open(os.path.join(directory, DATA_FILE), 'rb') as data_file:
+        for record in records:
+            data_file.seek(record['offset'])
+            frame = data_file.read(record['length'])
+            yield record['url'], record['timestamp'], decompressor.decompress(frame).decode('utf-8')
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import hashlib
+import requests
+import streamlit as st
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from archive import archive_page
+from fields import ENRICHED_FIELDS, DETAIL_FIELDS, extract_fields
+from functions import HEADERS
+
+# Listing details are fetched once per id and cached in an append-only JSONL file,
+# ids whose detail payload lacks the fields, or that were removed, are cached too
+# so they are not re-fetched
+DETAIL_URL = "https://www.immobiliare.it/api-next/listing/{listing_id}/?__lang=it"
+CACHE_FILE = os.environ.get("LISTING_CACHE_FILE", "./cache/listing_details.jsonl")
+MAX_WORKERS = 10
+REQUEST_TIMEOUT = 10
+# Removed listings: cached as misses, never fetched again
+GONE_STATUSES = (404, 410)
+# Throttling and server errors are retried with exponential backoff
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Cached records are tied to the detail spec they were extracted with: changing
+# DETAIL_URL or DETAIL_FIELDS makes the old records stale, so they are re-fetched
+SPEC_VERSION = hashlib.sha1(json.dumps([DETAIL_URL, DETAIL_FIELDS], sort_keys=True).encode()).hexdigest()[:12]
+
+
+def load_cache(cache_file=CACHE_FILE):
+    cache = {}
+    if not os.path.exists(cache_file):
+        return cache
+    with open(cache_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # A removed listing stays removed whatever the spec
+            if record.get('status') == 'gone' or record.get('version') == SPEC_VERSION:
+                cache[str(record['id'])] = record
+    return cache
+
+
+def save_cache(details, cache_file=CACHE_FILE):
+    if not details:
+        return
+    os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+    with open(cache_file, 'a', encoding='utf-8') as f:
+        for record in details.values():
+            f.write(json.dumps(record, default=str) + '\n')
+
+
+def read_listing_detail(listing_id, session="", retries=3, delay=1):
+    # Returns a cache record, or None on transient failures (not cached, retried next run)
+    url = DETAIL_URL.format(listing_id=listing_id)
+    record = {
+        'id': listing_id,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'version': SPEC_VERSION,
+        'status': 'ok',
+        'fields': {}
+    }
+    for attempt in range(retries):
+        try:
+            if session:
+                response = session.get(url, headers=HEADERS, timeout=REQUEST_TIMEOUT)
+            else:
+                response = requests.get(url, headers=HEADERS, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException:
+            time.sleep(delay * 2 ** attempt)
+            continue
+
+        if response.status_code in GONE_STATUSES:
+            record['status'] = 'gone'
+            return record
+        if response.status_code in RETRY_STATUSES:
+            time.sleep(delay * 2 ** attempt)
+            continue
+        if response.status_code != 200:
+            return None
+
+        try:
+            archive_page(url, response.text)
+        except (OSError, ImportError):
+            pass
+        try:
+            fields = extract_fields(json.loads(response.text), DETAIL_FIELDS)
+        except ValueError:
+            # Block or captcha page served with a 200
+            return None
+        # NaN is not valid JSON, missing fields are cached as null
+        record['fields'] = {col: (None if value != value else value) for col, value in fields.items()}
+        return record
+    return None
+
+
+def needs_fetch(record, fields):
+    if record is None:
+        return True
+    if record['status'] == 'gone':
+        return False
+    return any(col not in record['fields'] for col in fields if col in DETAIL_FIELDS)
+
+
+def enrich_listings(df, session="", fetch=True, fields=ENRICHED_FIELDS, cache_file=CACHE_FILE):
+    # Fill fields missing from the search results from the cached listing details,
+    # fetching (in parallel) only ids that lack them and have no usable cache record
+    if df.empty:
+        return df
+
+    for col in fields:
+        if col not in df.columns:
+            df[col] = None
+    missing_ids = [str(listing_id) for listing_id in df.index[df[fields].isna().any(axis=1)].unique()]
+
+    cache = load_cache(cache_file)
+    to_fetch = [listing_id for listing_id in missing_ids if needs_fetch(cache.get(listing_id), fields)] if fetch else []
+
+    if to_fetch:
+        details = {}
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = {executor.submit(read_listing_detail, listing_id, session): listing_id
+                       for listing_id in to_fetch}
+            for future in as_completed(futures):
+                result = future.result()
+                if result is not None:
+                    details[futures[future]] = result
+        save_cache(details, cache_file)
+        cache.update(details)
+        st.info(f"Dettagli recuperati per {len(details)} annunci su {len(to_fetch)}")
+
+    ids = df.index.to_series().astype(str)
+    for col in fields:
+        cached = ids.map(lambda listing_id: cache.get(listing_id, {}).get('fields', {}).get(col))
+        df[col] = df[col].where(df[col].notna(), cached)
+    return df
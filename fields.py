@@ -0,0 +1,96 @@
+import numpy as np
+
+# Declarative extraction spec for a search result item: column -> candidate paths.
+# A path is a sequence of dict keys / list indexes, the first path that resolves
+# to a value wins. Listings with several properties use the first one.
+PROPERTY = ('realEstate', 'properties', 0)
+
+LISTING_FIELDS = {
+    'realEstate_id': [('realEstate', 'id')],
+    'realEstate_isNew': [('realEstate', 'isNew')],
+    'realEstate_luxury': [('realEstate', 'luxury')],
+    'realEstate_contract': [('realEstate', 'contract')],
+    'saleType': [('realEstate', 'type')],
+    'seo_anchor': [('seo', 'anchor')],
+    'seo_url': [('seo', 'url')],
+    'description': [PROPERTY + ('description',)],
+    'category_name': [PROPERTY + ('category', 'name')],
+    'typology_name': [PROPERTY + ('typology', 'name')],
+    'ga4Condition': [PROPERTY + ('ga4Condition',)],
+    'ga4Heating': [PROPERTY + ('ga4Heating',), PROPERTY + ('energy', 'ga4Heating')],
+    'ga4Garage': [PROPERTY + ('ga4Garage',)],
+    'floor_abbreviation': [PROPERTY + ('floor', 'abbreviation')],
+    'floors': [PROPERTY + ('floors',)],
+    'surface': [PROPERTY + ('surface',)],
+    'rooms': [PROPERTY + ('rooms',)],
+    'bathrooms': [PROPERTY + ('bathrooms',)],
+    'price_value': [PROPERTY + ('price', 'value'), ('realEstate', 'price', 'value')],
+    'price_priceRange': [PROPERTY + ('price', 'priceRange'), ('realEstate', 'price', 'priceRange')],
+    'location_city': [PROPERTY + ('location', 'city')],
+    'location_latitude': [PROPERTY + ('location', 'latitude')],
+    'location_longitude': [PROPERTY + ('location', 'longitude')],
+    'location_macrozone': [PROPERTY + ('location', 'macrozone')],
+}
+
+FIELD_TYPES = {
+    'realEstate_isNew': 'boolean',
+    'realEstate_luxury': 'boolean',
+    'category_name': 'category',
+    'typology_name': 'category',
+    'ga4Condition': 'category',
+    'saleType': 'category',
+    'location_city': 'category',
+    'location_macrozone': 'category',
+    'price_priceRange': 'category',
+    'bathrooms': 'category',
+    'rooms': 'category',
+    'price_value': 'float'
+}
+
+# Fields the dashboard charts on that search results do not always carry,
+# filled from the listing detail payload (see enrichment.py)
+ENRICHED_FIELDS = ['ga4Heating', 'floor_abbreviation']
+
+# Same fields in the listing detail payload, which has the property list at the top level
+DETAIL_FIELDS = {
+    'ga4Heating': [('listing', 'properties', 0, 'ga4Heating'),
+                   ('listing', 'properties', 0, 'energy', 'ga4Heating')],
+    'floor_abbreviation': [('listing', 'properties', 0, 'floor', 'abbreviation')],
+}
+
+
+def get_path(item, path):
+    for key in path:
+        if isinstance(key, int):
+            if not isinstance(item, list) or len(item) <= key:
+                return None
+        elif not isinstance(item, dict):
+            return None
+        item = item[key] if isinstance(key, int) else item.get(key)
+        if item is None:
+            return None
+    return item
+
+
+def extract_fields(item, spec=LISTING_FIELDS):
+    record = {}
+    for column, paths in spec.items():
+        value = np.nan
+        for path in paths:
+            found = get_path(item, path)
+            if found is not None:
+                value = found
+                break
+        record[column] = value
+    return record
+
+
+def apply_field_types(df, field_types=FIELD_TYPES):
+    # Apply types only to columns that exist in the DataFrame
+    for col, dtype in field_types.items():
+        if col in df.columns:
+            try:
+                df[col] = df[col].astype(dtype)
+            except (TypeError, ValueError):
+                continue
+    return df
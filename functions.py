@@ -2,94 +2,53 @@ import streamlit as st
 import requests
 import json
 import pandas as pd
-import numpy as np
 import time
+from datetime import datetime, timezone
 import re
 import plotly.express as px
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import plotly.colors
+from analytics import mean_by_feature
+from archive import iter_archive, archive_page, list_crawls
+from fields import extract_fields, apply_field_types
 
-def read_page(url, session="", retries=3, delay=2):
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+def parse_page(text):
+    # Normalize the raw JSON of a search-list page into a DataFrame
+    data = json.loads(text)
+    results = data.get('results', [])
+    total_count = data.get('count', 0)
+    max_pages = data.get('maxPages', 0)
+    current_page = data.get('currentPage', 1)
+
+    if not results:
+        return pd.DataFrame(), 0, True, 0, 0
+
+    # Extract the columns declared in fields.LISTING_FIELDS
+    df = pd.DataFrame([extract_fields(item) for item in results]).set_index('realEstate_id')
+    df = apply_field_types(df)
+
+    return df, len(results), False, total_count, max_pages
+
+def read_page(url, session="", retries=3, delay=2, crawl_id=None):
     for attempt in range(retries):
         try:
             if session:
-                response = session.get(url, headers=headers)
+                response = session.get(url, headers=HEADERS)
             else:
-                response = requests.get(url, headers=headers)
+                response = requests.get(url, headers=HEADERS)
 
             if response.status_code == 200:
-                data = json.loads(response.text)
-                results = data.get('results', [])
-                total_count = data.get('count', 0)
-                max_pages = data.get('maxPages', 0)
-                current_page = data.get('currentPage', 1)
-
-                if not results:
-                    return pd.DataFrame(), 0, True, 0, 0
-
-                # Flatten nested JSON using pandas json_normalize
-                df = pd.json_normalize(
-                    results,
-                    record_path=['realEstate', 'properties'],
-                    meta=[
-                        ['realEstate', 'id'],
-                        ['realEstate', 'isNew'],
-                        ['realEstate', 'luxury'],
-                        ['realEstate', 'contract'],
-                        ['seo', 'anchor'],
-                        ['seo', 'url']
-                    ],
-                    errors='ignore'
-                )
-
-                # Rename columns to remove dots
-                df.columns = df.columns.str.replace('.', '_')
-
-                # Set index
-                if 'realEstate_id' in df.columns:
-                    df = df.set_index('realEstate_id')
-
-                # Extract nested values
-                if 'price' in df.columns:
-                    df['price_value'] = df['price'].apply(lambda x: x.get('value') if isinstance(x, dict) else None)
-                    df['price_priceRange'] = df['price'].apply(lambda x: x.get('priceRange') if isinstance(x, dict) else None)
-                    df.drop('price', axis=1, inplace=True)
-
-                if 'location' in df.columns:
-                    df['location_city'] = df['location'].apply(lambda x: x.get('city') if isinstance(x, dict) else None)
-                    df['location_latitude'] = df['location'].apply(lambda x: x.get('latitude') if isinstance(x, dict) else None)
-                    df['location_longitude'] = df['location'].apply(
-                        lambda x: x.get('longitude') if isinstance(x, dict) else None)
-                    df['location_macrozone'] = df['location'].apply(
-                        lambda x: x.get('macrozone') if isinstance(x, dict) else None)
-                    df.drop('location', axis=1, inplace=True)
-
-                # Apply data types
-                data_types = {
-                    'isNew': 'boolean',
-                    'luxury': 'boolean',
-                    'contract': 'category',
-                    'category_name': 'category',
-                    'ga4Condition': 'category',
-                    'location_city': 'category',
-                    'location_macrozone': 'category',
-                    'price_priceRange': 'category',
-                    'bathrooms': 'category',
-                    'rooms': 'category',
-                    'price_value': 'float'
-                }
-
-                for col, dtype in data_types.items():
-                    if col in df.columns:
-                        try:
-                            df[col] = df[col].astype(dtype)
-                        except:
-                            continue
-
-                return df, len(results), False, total_count, max_pages
+                # Keep the raw page for offline replay, archiving must not fail the crawl
+                try:
+                    archive_page(url, response.text, crawl_id=crawl_id)
+                except (OSError, ImportError) as e:
+                    st.write(f"Archive error: {e}")
+
+                return parse_page(response.text)
 
             return pd.DataFrame(), 0, True, 0, 0
 
@@ -105,6 +64,8 @@ def fetch_all_pages(base_url, session, timeout_minutes=2):
     all_houses_df = pd.DataFrame()
     total_properties = 0
     start_time = time.time()
+    # Groups the archived pages of this run, see archive.py
+    crawl_id = datetime.now(timezone.utc).isoformat()
     max_pages = 80
     pages_scanned = 0
     start_run = True
@@ -118,12 +79,12 @@ def fetch_all_pages(base_url, session, timeout_minutes=2):
             # Get first page to check total count and max pages
             first_page_url = f"{base_url}&pag=1"
             if start_run:
-                df, count, fail, total_count, max_pages = read_page(first_page_url, session)
+                df, count, fail, total_count, max_pages = read_page(first_page_url, session, crawl_id=crawl_id)
                 st.info(f"Numero di annunci da caricare: {total_count} (in {max_pages} pagine)")
                 start_run=False
                 should_break = False  # Flag to control breaking out of all loops
             else:
-                df, count, fail, _, max_pages = read_page(first_page_url, session)
+                df, count, fail, _, max_pages = read_page(first_page_url, session, crawl_id=crawl_id)
 
             if fail or count == 0:
 #                should_break = True
@@ -140,7 +101,7 @@ def fetch_all_pages(base_url, session, timeout_minutes=2):
                 futures = []
                 for page in range(batch_start, batch_end + 1):
                     page_url = f"{base_url}&pag={page}"
-                    futures.append(executor.submit(read_page, page_url, session))
+                    futures.append(executor.submit(read_page, page_url, session, crawl_id=crawl_id))
 
                 batch_results = []
                 for future in as_completed(futures):
@@ -187,6 +148,57 @@ def fetch_all_pages(base_url, session, timeout_minutes=2):
 
     return all_houses_df, total_properties
 
+def archive_match(filters):
+    # Query parameters identifying the archived pages of the selected comune
+    return {
+        'fkRegione': filters['regione'],
+        'idProvincia': filters['provincia'],
+        'idComune': filters['comune']
+    }
+
+def replay_pages(filters, crawl_id=None, since=None, until=None):
+    # Rebuild the listings of one archived crawl, without network. Without a
+    # crawl_id or a since/until window the latest crawl of the search is used;
+    # a window explicitly merges every crawl in it
+    match = archive_match(filters)
+    if crawl_id is None and since is None and until is None:
+        crawls = list_crawls(match=match)
+        if not crawls:
+            st.warning("Nessuna pagina archiviata per il comune selezionato")
+            return pd.DataFrame(), 0
+        crawl_id = next(iter(crawls))
+
+    pages = []
+    skipped = 0
+    for url, timestamp, text in iter_archive(match=match, since=since, until=until, crawl_id=crawl_id):
+        # Block/captcha pages are archived as served, they are not valid search JSON
+        try:
+            df, count, fail, _, _ = parse_page(text)
+        except (ValueError, AttributeError, KeyError):
+            skipped += 1
+            continue
+        if not fail and count > 0:
+            pages.append((timestamp, df))
+
+    if skipped:
+        st.warning(f"Ignorate {skipped} pagine archiviate non leggibili")
+
+    if not pages:
+        st.warning("Nessuna pagina archiviata per il comune selezionato")
+        return pd.DataFrame(), 0
+
+    # Pages of one crawl overlap across price batches, keep the most recent snapshot
+    pages.sort(key=lambda page: page[0], reverse=True)
+    all_houses_df = pd.concat([df for _, df in pages])
+    all_houses_df = all_houses_df[~all_houses_df.index.duplicated(keep='first')]
+
+    # Archived crawls may have used a different price range
+    all_houses_df = all_houses_df[all_houses_df['price_value'].between(filters['prezzoMinimo'], filters['prezzoMassimo'])]
+    total_properties = len(all_houses_df)
+
+    st.success(f"Ricostruiti n°{total_properties} annunci da {len(pages)} pagine archiviate")
+    return all_houses_df, total_properties
+
 def get_search_url(filters):
     base_url = "https://www.immobiliare.it/api-next/search-list/listings"
     params = {
@@ -241,88 +253,10 @@ def create_filters(geodata):
 
     return filters
 
-def read_page_bak(url, session=""):
-
-    def getp(mydict, prop):
-        return mydict.get(prop, np.nan) if isinstance(mydict, dict) else np.nan
-
-    if session == "":
-        response = requests.get(url)
-    else:
-        response = session.get(url)
-
-    if response.status_code == 200:
-        data = json.loads(response.text)
-        allproperties = data.get('results', {})
-
-        seo_data = [allproperties[houseno].get('seo', {}) for houseno in range(len(allproperties))]
-        realEstate_data = [allproperties[houseno].get('realEstate', {}) for houseno in range(len(allproperties))]
-        properties = [realEstate_data[houseno].get('properties', [{}])[0] for houseno in range(len(allproperties))]
-
-        houses_data = [
-            {
-                'id': getp(realEstate_data[houseno], 'id'),
-                'isNew': getp(realEstate_data[houseno], 'isNew'),
-                'luxury': getp(realEstate_data[houseno], 'luxury'),
-                'contract': getp(realEstate_data[houseno], 'contract'),
-                'description': getp(properties[houseno], 'description'),
-                'condition': getp(properties[houseno], 'ga4Condition'),
-                'floors': getp(properties[houseno], 'floor'),
-                'garage': getp(properties[houseno], 'ga4Garage'),
-                'surface': getp(properties[houseno], 'surface'),
-                'bathrooms': getp(properties[houseno], 'bathrooms'),
-                'rooms': getp(properties[houseno], 'rooms'),
-                'saleType': getp(realEstate_data[houseno], 'type'),
-                'anchor': getp(seo_data[houseno], 'anchor'),
-                'category': getp(getp(properties[houseno], 'category'), 'name'),
-                'heatingType': getp(getp(properties[houseno], 'energy'), 'ga4Heating'),
-                'floor_value': getp(getp(properties[houseno], 'floor'), 'abbreviation'),
-                'location_city': getp(getp(properties[houseno], 'location'), 'city'),
-                'location_latitude': getp(getp(properties[houseno], 'location'), 'latitude'),
-                'location_longitude': getp(getp(properties[houseno], 'location'), 'longitude'),
-                'location_macrozone': getp(getp(properties[houseno], 'location'), 'macrozone'),
-                'price_value': getp(getp(properties[houseno], 'price'), 'value'),
-                'price_priceRange': getp(getp(properties[houseno], 'price'), 'priceRange'),
-            }
-            for houseno in range(len(allproperties))
-        ]
-
-        house_df = pd.DataFrame(houses_data).set_index('id')
-
-        # Apply data types only to columns that exist
-        data_types = {
-            'isNew': 'boolean',
-            'luxury': 'boolean',
-            'contract': 'category',
-            'category': 'category',
-            'condition': 'category',
-            'location_city': 'category',
-            'location_macrozone': 'category',
-            'price_priceRange': 'category',
-            'saleType': 'category',
-            'bathrooms': 'category',
-            'rooms': 'category',
-            'price_value': 'float'
-        }
-
-        # Apply types only to columns that exist in the DataFrame
-        for col, dtype in data_types.items():
-            if col in house_df.columns:
-                try:
-                    house_df[col] = house_df[col].astype(dtype)
-                except:
-                    continue
-
-        countcheck = len(allproperties)
-        fail = 0
-        return house_df, countcheck, fail
-    else:
-        return pd.DataFrame(), 0, 1
-
-def price_by_feature(houses_df, feature):
+def price_by_feature_figure(houses_df, feature, backend="pandas"):
     # Price per m² by condition
     # Calculate average priceperm2 for each condition
-    price_by_feature = houses_df.groupby(feature)['priceperm2'].mean().reset_index()
+    price_by_feature = mean_by_feature(houses_df, feature, backend)
 
     # Create a DataFrame with the conditions and their average prices
     price_condition_df = pd.DataFrame({
@@ -352,6 +286,4 @@ def price_by_feature(houses_df, feature):
         xaxis_title=feature,
         yaxis_title="Prezzo Medio per Metro Quadro (€)"
     )
-
-    # Display the chart
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
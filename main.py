@@ -1,10 +1,15 @@
 import streamlit as st
 import requests
 import pandas as pd
-import folium
-from streamlit_folium import folium_static
-import plotly.express as px
-from functions import read_page, fetch_all_pages, get_search_url, create_filters, price_by_feature
+import streamlit.components.v1 as components
+from datetime import date, timedelta
+from functions import read_page, fetch_all_pages, replay_pages, archive_match, get_search_url, create_filters
+from archive import list_crawls
+from profiling import RerunProfiler
+from enrichment import enrich_listings
+from analytics import get_backend, process_listings
+from views import dataset_key, get_view, get_stats, get_map_html, get_condition_count_figure, \
+    get_condition_price_figure, get_feature_figure
 import seaborn as sns
 import matplotlib.pyplot as plt
 
@@ -15,212 +20,165 @@ def main():
         page_icon="🏘️",
         layout="wide"
     )
+    # Stage timings for this rerun, see profiling.py. cProfile/tracemalloc are
+    # one-shot: the button arms them for the next rerun only
+    profiler = RerunProfiler(deep=st.session_state.pop('profile_next_rerun', False))
+    if st.sidebar.button("Profila la prossima esecuzione"):
+        st.session_state['profile_next_rerun'] = True
+
+    try:
+        dashboard(profiler)
+    except BaseException as e:
+        # Includes Streamlit interrupting the rerun when a widget changes
+        profiler.error = type(e).__name__
+        raise
+    finally:
+        # Timing breakdown and machine-readable trace
+        profiler.finish()
+        profiler.render()
+
+def dashboard(profiler):
+    # Analytics backend (pandas, arrow or polars), see analytics.py
+    backend = get_backend()
+
     # Initialize houses dataframe
     if 'houses_df_all' not in st.session_state:
         st.session_state['houses_df_all'] = pd.DataFrame()
+        st.session_state['dataset_key'] = ""
 
     st.title("Analisi Mercato Immobiliare")
     st.write("Questo tool permette di analizzare il mercato immobiliare del comune selezionato consultando gli annunci online sul sito Immobiliare.it."
              "I dati sono aggiornati in tempo reale e vengono visualizzati in forma di grafici e mappe interattive."
              "Per iniziare, seleziona il comune di interesse, indica un range di prezzo e clicca su 'Avvia Ricerca'.")
     # Import Geo data
-    geodata = pd.read_csv('./geodata/geo_data.csv')
+    with profiler.stage('geodata'):
+        geodata = pd.read_csv('./geodata/geo_data.csv')
 
     # Create filters
-    filters = create_filters(geodata)
-
-    if st.button("Avvia Ricerca"):
+    with profiler.stage('filters'):
+        filters = create_filters(geodata)
+    profiler.context.update(filters, backend=backend)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        start_search = st.button("Avvia Ricerca")
+    with col2:
+        # Offline mode: re-parse the archived raw pages instead of crawling.
+        # One crawl at a time (latest first), merging crawls needs an explicit window
+        crawls = list_crawls(match=archive_match(filters))
+        window_option = "Intervallo di date (unisce più ricerche)"
+        replay_choice = st.selectbox(
+            "Ricerca archiviata",
+            list(crawls) + [window_option],
+            format_func=lambda crawl: crawl if crawl == window_option
+            else f"{crawl[:16].replace('T', ' ')} ({crawls[crawl]} pagine)"
+        )
+        replay_args = {'crawl_id': replay_choice}
+        if replay_choice == window_option:
+            window = st.date_input("Intervallo", value=(date.today() - timedelta(days=30), date.today()))
+            # The end date is included, a single picked day is a one-day window
+            replay_args = {'since': window[0].isoformat(), 'until': (window[-1] + timedelta(days=1)).isoformat()} if window else {}
+        start_replay = st.button("Rielabora Archivio", disabled=not crawls or not replay_args)
+
+    if start_replay:
+        with st.spinner("Rielaboro le pagine archiviate..."):
+            with profiler.stage('crawl'):
+                houses_df_all, total_properties = replay_pages(filters, **replay_args)
+
+            # Offline: only listing details already in the cache are used
+            with profiler.stage('enrichment'):
+                houses_df_all = enrich_listings(houses_df_all, fetch=False)
+
+            # New dataset: derived artifacts are keyed on its content
+            st.session_state['dataset_key'] = dataset_key(houses_df_all)
+
+            # Data processing
+            with profiler.stage('processing'):
+                st.session_state['houses_df_all'] = process_listings(houses_df_all, backend) if not houses_df_all.empty else houses_df_all
+
+    if start_search:
         with st.spinner("Recupero gli annunci..."):
             url = get_search_url(filters)
 
             progress_text = st.empty()
 
             with requests.Session() as session:
-                st.session_state['houses_df_all'], total_properties = fetch_all_pages(url, session)
+                with profiler.stage('crawl'):
+                    houses_df_all, total_properties = fetch_all_pages(url, session)
+
+                # Fetch details for listings missing charted fields
+                with profiler.stage('enrichment'):
+                    houses_df_all = enrich_listings(houses_df_all, session)
+
+                # New dataset: derived artifacts are keyed on its content
+                st.session_state['dataset_key'] = dataset_key(houses_df_all)
 
                 # Data processing
-                st.session_state['houses_df_all']['surface'] = st.session_state['houses_df_all']['surface'].str.replace(' m²', '').astype(float)
-                st.session_state['houses_df_all']['priceperm2'] = st.session_state['houses_df_all']['price_value'] / st.session_state['houses_df_all']['surface']
+                with profiler.stage('processing'):
+                    st.session_state['houses_df_all'] = process_listings(houses_df_all, backend)
 
-    if not st.session_state['houses_df_all'].empty:
+    if len(st.session_state['houses_df_all']) > 0:
         aste = st.selectbox('Escludi Aste', ['Escludi', 'Includi'])
         aste_excluded = aste == 'Escludi'
 
-        if aste_excluded:
-            houses_df = st.session_state['houses_df_all'][st.session_state['houses_df_all']['realEstate_contract'] == 'sale'].copy()
-            st.info(f'Il numero di annunci è stato ridotto a {len(houses_df)}')
-        else:
-            houses_df = st.session_state['houses_df_all'].copy()
+        # Every artifact below is cached on the dataset content hash and the view parameters
+        view_key = (st.session_state['dataset_key'], aste_excluded, backend)
+
+        with profiler.stage('filtering'):
+            houses_df = get_view(st.session_state['houses_df_all'], *view_key)
+            if aste_excluded:
+                st.info(f'Il numero di annunci è stato ridotto a {len(houses_df)}')
 
         # Display statistics
         st.subheader("Statistics")
-        col1, col2 = st.columns(2)
+        with profiler.stage('statistics'):
+            stats = get_stats(houses_df, *view_key)
+            col1, col2 = st.columns(2)
 
-        with col1:
-            st.metric("Numero Annunci", len(houses_df))
-            st.metric("Prezzo Medio", f"€{houses_df['price_value'].mean():,.0f}")
-            st.metric("Superficie Media", f"{houses_df['surface'].mean():.0f}m²")
+            with col1:
+                st.metric("Numero Annunci", stats['count'])
+                st.metric("Prezzo Medio", f"€{stats['price_mean']:,.0f}")
+                st.metric("Superficie Media", f"{stats['surface_mean']:.0f}m²")
 
-        with col2:
-            st.metric("Prezzo Mediano/m²", f"€{houses_df['priceperm2'].median():,.0f}")
-            st.metric("Prezzo Minimo", f"€{houses_df['price_value'].min():,.0f}")
-            st.metric("Prezzo Massimo", f"€{houses_df['price_value'].max():,.0f}")
+            with col2:
+                st.metric("Prezzo Mediano/m²", f"€{stats['priceperm2_median']:,.0f}")
+                st.metric("Prezzo Minimo", f"€{stats['price_min']:,.0f}")
+                st.metric("Prezzo Massimo", f"€{stats['price_max']:,.0f}")
 
         # Create map
-        # Find first valid coordinates for map center
         st.subheader('Mappa delle proprietà')
-        map_center = [45.4642, 9.1900]  # Default to Milan center
-        zoom_start = 12  # Default zoom level
-
-        # Get first valid coordinates from the dataframe
-        valid_coords = houses_df[houses_df['location_latitude'].notna() &
-                                 houses_df['location_longitude'].notna()]
-        if not valid_coords.empty:
-            first_house = valid_coords.iloc[0]
-            map_center = [float(first_house['location_latitude']),
-                          float(first_house['location_longitude'])]
-
-        m = folium.Map(location=map_center, zoom_start=zoom_start)
-
-        # Calculate min and max values for price/m2 to create color scale
-        min_price = houses_df['priceperm2'].min()
-        max_price = houses_df['priceperm2'].max()
-
-        def get_color(value):
-            # Normalize the value between 0 and 1
-            normalized = (value - min_price) / (max_price - min_price)
-            
-            # Create RGB values for gradient from green (low) through yellow to red (high)
-            if normalized <= 0.5:
-                # Green to Yellow gradient
-                r = int(255 * (2 * normalized))
-                g = 255
-                b = 0
-            else:
-                # Yellow to Red gradient
-                r = 255
-                g = int(255 * (2 * (1 - normalized)))
-                b = 0
-            
-            return f'#{r:02x}{g:02x}{b:02x}'
-
-        for _, row in houses_df.reset_index().iterrows():
-            if pd.notna(row['location_latitude']) and pd.notna(row['location_longitude']):
-                folium.CircleMarker(
-                    location=[float(row['location_latitude']), float(row['location_longitude'])],
-                    radius=8,
-                    popup=f"ID: {row['realEstate_id']}<br>"
-                          f"Price: €{row['price_value']:,.0f}<br>"
-                          f"Surface: {row['surface']}m²<br>"
-                          f"Price/m²: €{row['priceperm2']:,.0f}<br>"
-                          f"Condition: {row['ga4Condition']}<br>"
-                          f"Heating: {row['ga4Heating']}",
-                    color=get_color(row['priceperm2']),
-                    fill=True,
-                    fill_color=get_color(row['priceperm2'])
-                ).add_to(m)
-
-        folium_static(m)
-
-        # Define the order and colors
-        condition_order = ["Da ristrutturare", "Buono / Abitabile", "Ottimo / Ristrutturato",
-                           "Nuovo / In costruzione"]
-        viridis_colors = ["#440154", "#21908C", "#55C667", "#FDE725"]
-
-        # Get the condition counts
-        condition_counts = houses_df['ga4Condition'].value_counts()
-
-        # Reorder the data according to your desired order
-        # Create a DataFrame for better control
-        condition_df = pd.DataFrame({
-            'Condition': condition_counts.index,
-            'Count': condition_counts.values
-        })
-
-        # Reorder based on your condition_order
-        condition_df['Order'] = condition_df['Condition'].map(
-            {cond: i for i, cond in enumerate(condition_order)})
-        condition_df = condition_df.sort_values('Order')
+        with profiler.stage('map'):
+            components.html(get_map_html(houses_df, *view_key), height=510, width=700)
 
         # Display additional statistics
         st.subheader("Numero di Proprietà per Condizione")
+        with profiler.stage('chart_condition_count'):
+            st.plotly_chart(get_condition_count_figure(houses_df, *view_key), use_container_width=True)
 
-        # Create interactive Plotly chart
-        fig = px.bar(
-            condition_df,
-            x='Condition',
-            y='Count',
-            color='Condition',
-            color_discrete_map={cond: color for cond, color in zip(condition_order, viridis_colors)},
-            category_orders={"Condition": condition_order}
-        )
-
-        # Update layout
-        fig.update_layout(
-            showlegend=False,
-            xaxis_title="Condizione",
-            yaxis_title="Numero di Proprietà",
-            xaxis={'categoryorder': 'array', 'categoryarray': condition_order}
-        )
-
-        # Display the chart
-        st.plotly_chart(fig, use_container_width=True)
-
-        # Price per m² by condition
-        # Calculate average priceperm2 for each condition
-        price_by_condition = houses_df.groupby('ga4Condition')['priceperm2'].mean().reset_index()
-
-        # Create a DataFrame with the conditions and their average prices
-        price_condition_df = pd.DataFrame({
-            'Condition': price_by_condition['ga4Condition'],
-            'AveragePricePerM2': price_by_condition['priceperm2']
-        })
-
-        # Reorder based on your condition_order
-        price_condition_df['Order'] = price_condition_df['Condition'].map(
-            {cond: i for i, cond in enumerate(condition_order)})
-        price_condition_df = price_condition_df.sort_values('Order')
-
-        # Display chart title
         st.subheader("Prezzo Medio per Metro Quadro per Condizione")
-
-        # Create interactive Plotly chart
-        fig = px.bar(
-            price_condition_df,
-            x='Condition',
-            y='AveragePricePerM2',
-            color='Condition',
-            color_discrete_map={cond: color for cond, color in zip(condition_order, viridis_colors)},
-            category_orders={"Condition": condition_order}
-        )
-
-        # Update layout
-        fig.update_layout(
-            showlegend=False,
-            xaxis_title="Condizione",
-            yaxis_title="Prezzo Medio per Metro Quadro (€)",
-            xaxis={'categoryorder': 'array', 'categoryarray': condition_order}
-        )
-
-        # Display the chart
-        st.plotly_chart(fig, use_container_width=True)
-
+        with profiler.stage('chart_condition_price'):
+            st.plotly_chart(get_condition_price_figure(houses_df, *view_key), use_container_width=True)
 
         st.subheader("Prezzo Medio per Metro Quadro per Numero di Stanze")
-        price_by_feature(houses_df, 'rooms')
+        with profiler.stage('chart_rooms'):
+            st.plotly_chart(get_feature_figure(houses_df, *view_key, 'rooms'), use_container_width=True)
 
         st.subheader("Prezzo Medio per Metro Quadro per Piano")
-        price_by_feature(houses_df, 'floor_abbreviation')
+        with profiler.stage('chart_floor_abbreviation'):
+            st.plotly_chart(get_feature_figure(houses_df, *view_key, 'floor_abbreviation'), use_container_width=True)
 
         st.subheader("Prezzo Medio per Metro Quadro per Numero di Bagni")
-        price_by_feature(houses_df, 'bathrooms')
+        with profiler.stage('chart_bathrooms'):
+            st.plotly_chart(get_feature_figure(houses_df, *view_key, 'bathrooms'), use_container_width=True)
 
         st.subheader("Prezzo Medio per Metro Quadro per Riscaldamento")
-        price_by_feature(houses_df, 'ga4Heating')
+        with profiler.stage('chart_ga4Heating'):
+            st.plotly_chart(get_feature_figure(houses_df, *view_key, 'ga4Heating'), use_container_width=True)
 
         # Elenco delle proprietà
         st.subheader("Elenco delle proprietà")
-        st.dataframe(houses_df)
+        with profiler.stage('dataframe'):
+            st.dataframe(houses_df)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
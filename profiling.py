@@ -0,0 +1,127 @@
+import os
+import io
+import json
+import time
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import pandas as pd
+import streamlit as st
+
+# Every rerun appends one JSON line with its stage timings to reruns.jsonl in this
+# directory. Set PROFILE_TRACE_DIR to an empty string to disable the trace file.
+TRACE_DIR = os.environ.get("PROFILE_TRACE_DIR", "./traces")
+TRACE_FILE = "reruns.jsonl"
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 10
+
+
+class RerunProfiler:
+    """
+    Times the stages of one Streamlit rerun.
+
+    Stage wall times are always recorded. When deep is True the rerun is also
+    run under cProfile and tracemalloc (script thread only, the crawl worker
+    threads are not seen by cProfile).
+    """
+
+    def __init__(self, deep=False):
+        self.deep = deep
+        self.context = {}
+        self.stages = []
+        self.total = 0.0
+        self.profile = None
+        self.profile_stats = ""
+        self.allocations = []
+        self.error = None
+        self.finished = False
+        self.start = time.perf_counter()
+        self.timestamp = datetime.now(timezone.utc).isoformat()
+
+        # Only stop tracemalloc in finish() if this profiler started it
+        self.started_tracemalloc = False
+        if deep:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracemalloc = True
+            self.profile = cProfile.Profile()
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Another profiler is active (e.g. a concurrent session)
+                self.profile = None
+
+    @contextmanager
+    def stage(self, name):
+        if self.deep and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {
+                'stage': name,
+                'start_s': start - self.start,
+                'duration_s': time.perf_counter() - start
+            }
+            if self.deep and tracemalloc.is_tracing():
+                record['peak_mem_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            self.stages.append(record)
+
+    def finish(self):
+        # Must run for every rerun, including failed or interrupted ones, so the
+        # profilers are always turned off again
+        if self.finished:
+            return
+        self.finished = True
+        self.total = time.perf_counter() - self.start
+
+        if self.profile is not None:
+            self.profile.disable()
+            output = io.StringIO()
+            pstats.Stats(self.profile, stream=output).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            self.profile_stats = output.getvalue()
+
+        if self.deep and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+            self.allocations = [
+                {'location': str(stat.traceback), 'size_mb': stat.size / 2 ** 20, 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+            ]
+
+        self.write_trace()
+
+    def write_trace(self, directory=TRACE_DIR):
+        if not directory:
+            return
+        record = {
+            'timestamp': self.timestamp,
+            'context': self.context,
+            'total_s': self.total,
+            'error': self.error,
+            'stages': self.stages,
+            'allocations': self.allocations
+        }
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, TRACE_FILE), 'a', encoding='utf-8') as trace_file:
+            trace_file.write(json.dumps(record, default=str) + '\n')
+
+    def render(self):
+        # Breakdown panel, call after finish()
+        with st.sidebar.expander("Tempi di esecuzione", expanded=self.deep):
+            st.metric("Totale", f"{self.total:.2f}s")
+            if self.error:
+                st.warning(f"Esecuzione interrotta: {self.error}")
+            if self.stages:
+                stages_df = pd.DataFrame(self.stages).set_index('stage')
+                stages_df['share'] = stages_df['duration_s'] / self.total
+                st.bar_chart(stages_df['duration_s'])
+                st.dataframe(stages_df)
+            if self.profile_stats:
+                st.text(self.profile_stats)
+            if self.allocations:
+                st.dataframe(pd.DataFrame(self.allocations))
@@ -0,0 +1,184 @@
+import hashlib
+import pandas as pd
+import folium
+import plotly.express as px
+import streamlit as st
+from analytics import filter_sales, summary_stats, count_by_feature, mean_by_feature, to_pandas
+from functions import price_by_feature_figure
+
+# Derived artifacts of the dashboard are memoized on the content hash of the
+# dataset plus the view parameters, so widget interactions after a crawl do not
+# recompute them. Arguments starting with an underscore are not hashed by
+# Streamlit: the data itself is identified by dataset_key. The caches are shared
+# by all sessions and never cleared explicitly: a new dataset gets a new key, and
+# max_entries evicts the entries of older datasets.
+MAX_VIEWS = 4
+MAX_ARTIFACTS = 32
+
+# Define the order and colors
+CONDITION_ORDER = ["Da ristrutturare", "Buono / Abitabile", "Ottimo / Ristrutturato",
+                   "Nuovo / In costruzione"]
+VIRIDIS_COLORS = ["#440154", "#21908C", "#55C667", "#FDE725"]
+MAP_COLUMNS = ['location_latitude', 'location_longitude', 'price_value', 'surface',
+               'priceperm2', 'ga4Condition', 'ga4Heating']
+
+
+def dataset_key(df):
+    # Content hash of the crawled listings (pandas, before processing)
+    if df.empty:
+        return ""
+    hashes = pd.util.hash_pandas_object(df, index=True)
+    return hashlib.sha1(hashes.values.tobytes() + ','.join(map(str, df.columns)).encode()).hexdigest()
+
+
+@st.cache_resource(max_entries=MAX_VIEWS, show_spinner=False)
+def get_view(_data, key, aste_excluded, backend):
+    # Views are never mutated, cache_resource hands back the same object without copying
+    if aste_excluded:
+        return filter_sales(_data, backend)
+    return _data
+
+
+@st.cache_data(max_entries=MAX_ARTIFACTS, show_spinner=False)
+def get_stats(_view, key, aste_excluded, backend):
+    return summary_stats(_view, backend)
+
+
+@st.cache_data(max_entries=MAX_ARTIFACTS, show_spinner=False)
+def get_map_html(_view, key, aste_excluded, backend):
+    # Find first valid coordinates for map center
+    map_center = [45.4642, 9.1900]  # Default to Milan center
+    zoom_start = 12  # Default zoom level
+
+    # Only the columns used by the map are materialized as pandas
+    map_df = to_pandas(_view, backend, MAP_COLUMNS)
+
+    # Get first valid coordinates from the dataframe
+    valid_coords = map_df[map_df['location_latitude'].notna() &
+                          map_df['location_longitude'].notna()]
+    if not valid_coords.empty:
+        first_house = valid_coords.iloc[0]
+        map_center = [float(first_house['location_latitude']),
+                      float(first_house['location_longitude'])]
+
+    m = folium.Map(location=map_center, zoom_start=zoom_start)
+
+    # Calculate min and max values for price/m2 to create color scale
+    min_price = map_df['priceperm2'].min()
+    max_price = map_df['priceperm2'].max()
+
+    def get_color(value):
+        # Normalize the value between 0 and 1
+        normalized = (value - min_price) / (max_price - min_price)
+
+        # Create RGB values for gradient from green (low) through yellow to red (high)
+        if normalized <= 0.5:
+            # Green to Yellow gradient
+            r = int(255 * (2 * normalized))
+            g = 255
+            b = 0
+        else:
+            # Yellow to Red gradient
+            r = 255
+            g = int(255 * (2 * (1 - normalized)))
+            b = 0
+
+        return f'#{r:02x}{g:02x}{b:02x}'
+
+    for _, row in map_df.reset_index().iterrows():
+        if pd.notna(row['location_latitude']) and pd.notna(row['location_longitude']):
+            folium.CircleMarker(
+                location=[float(row['location_latitude']), float(row['location_longitude'])],
+                radius=8,
+                popup=f"ID: {row['realEstate_id']}<br>"
+                      f"Price: €{row['price_value']:,.0f}<br>"
+                      f"Surface: {row['surface']}m²<br>"
+                      f"Price/m²: €{row['priceperm2']:,.0f}<br>"
+                      f"Condition: {row['ga4Condition']}<br>"
+                      f"Heating: {row['ga4Heating']}",
+                color=get_color(row['priceperm2']),
+                fill=True,
+                fill_color=get_color(row['priceperm2'])
+            ).add_to(m)
+
+    # Rendered once to HTML, the same markup folium_static would produce
+    return folium.Figure().add_child(m).render()
+
+
+@st.cache_data(max_entries=MAX_ARTIFACTS, show_spinner=False)
+def get_condition_count_figure(_view, key, aste_excluded, backend):
+    # Get the condition counts
+    condition_counts = count_by_feature(_view, 'ga4Condition', backend)
+
+    # Reorder the data according to your desired order
+    # Create a DataFrame for better control
+    condition_df = pd.DataFrame({
+        'Condition': condition_counts.index,
+        'Count': condition_counts.values
+    })
+
+    # Reorder based on your condition_order
+    condition_df['Order'] = condition_df['Condition'].map(
+        {cond: i for i, cond in enumerate(CONDITION_ORDER)})
+    condition_df = condition_df.sort_values('Order')
+
+    # Create interactive Plotly chart
+    fig = px.bar(
+        condition_df,
+        x='Condition',
+        y='Count',
+        color='Condition',
+        color_discrete_map={cond: color for cond, color in zip(CONDITION_ORDER, VIRIDIS_COLORS)},
+        category_orders={"Condition": CONDITION_ORDER}
+    )
+
+    # Update layout
+    fig.update_layout(
+        showlegend=False,
+        xaxis_title="Condizione",
+        yaxis_title="Numero di Proprietà",
+        xaxis={'categoryorder': 'array', 'categoryarray': CONDITION_ORDER}
+    )
+    return fig
+
+
+@st.cache_data(max_entries=MAX_ARTIFACTS, show_spinner=False)
+def get_condition_price_figure(_view, key, aste_excluded, backend):
+    # Price per m² by condition
+    # Calculate average priceperm2 for each condition
+    price_by_condition = mean_by_feature(_view, 'ga4Condition', backend)
+
+    # Create a DataFrame with the conditions and their average prices
+    price_condition_df = pd.DataFrame({
+        'Condition': price_by_condition['ga4Condition'],
+        'AveragePricePerM2': price_by_condition['priceperm2']
+    })
+
+    # Reorder based on your condition_order
+    price_condition_df['Order'] = price_condition_df['Condition'].map(
+        {cond: i for i, cond in enumerate(CONDITION_ORDER)})
+    price_condition_df = price_condition_df.sort_values('Order')
+
+    # Create interactive Plotly chart
+    fig = px.bar(
+        price_condition_df,
+        x='Condition',
+        y='AveragePricePerM2',
+        color='Condition',
+        color_discrete_map={cond: color for cond, color in zip(CONDITION_ORDER, VIRIDIS_COLORS)},
+        category_orders={"Condition": CONDITION_ORDER}
+    )
+
+    # Update layout
+    fig.update_layout(
+        showlegend=False,
+        xaxis_title="Condizione",
+        yaxis_title="Prezzo Medio per Metro Quadro (€)",
+        xaxis={'categoryorder': 'array', 'categoryarray': CONDITION_ORDER}
+    )
+    return fig
+
+
+@st.cache_data(max_entries=MAX_ARTIFACTS, show_spinner=False)
+def get_feature_figure(_view, key, aste_excluded, backend, feature):
+    return price_by_feature_figure(_view, feature, backend)